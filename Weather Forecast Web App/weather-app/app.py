@@ -8,11 +8,37 @@ Author: AI Assistant
 Date: 2026-01-31
 """
 
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, send_file, g
+from flask.cli import AppGroup
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED, CancelledError
+import base64
+import click
 import requests
+import urllib3
 import os
+import csv
+import hashlib
+import ipaddress
+import json
+import operator
 import random
+import socket
+import sqlite3
+import threading
+import time
 from datetime import datetime
+from urllib.parse import urlsplit
+
+# Optional compact encodings - offered only when the library is installed
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
 
 # Initialize Flask application
 app = Flask(__name__)
@@ -25,6 +51,80 @@ BASE_URL = 'https://api.openweathermap.org/data/2.5'
 # Demo mode - provides mock data when API key is not available
 DEMO_MODE = OPENWEATHER_API_KEY == 'demo' or OPENWEATHER_API_KEY == 'your_api_key_here'
 
+# Weather icons are fetched once from OpenWeatherMap and served from a local cache
+ICON_SOURCE_URL = 'https://openweathermap.org/img/wn/{code}@2x.png'
+ICON_BASE_URL = os.environ.get('WEATHER_ICON_BASE_URL', '/icons')
+ICON_CACHE_DIR = os.environ.get('WEATHER_ICON_CACHE_DIR', os.path.join(app.instance_path, 'icons'))
+ICON_CODES = tuple(f'{n}{period}' for n in ('01', '02', '03', '04', '09', '10', '11', '13', '50')
+                   for period in ('d', 'n'))
+ICON_MAX_AGE = 365 * 24 * 60 * 60  # seconds - icons never change for a given code
+icon_download_lock = threading.Lock()
+icon_sprite = None  # Built on first request to /icons/sprite.css
+
+# Upstream request budget - the free OpenWeatherMap plan allows 60 calls/minute
+UPSTREAM_CALLS_PER_MINUTE = int(os.environ.get('OPENWEATHER_CALLS_PER_MINUTE', 60))
+
+# Local snapshot written by `flask weather warm` and served before calling the API
+SNAPSHOT_PATH = os.environ.get('WEATHER_SNAPSHOT_PATH', os.path.join(app.instance_path, 'snapshot.db'))
+SNAPSHOT_MAX_AGE = int(os.environ.get('WEATHER_SNAPSHOT_MAX_AGE', 6 * 60 * 60))  # seconds
+
+# Per-client API keys - see load_api_keys() for the file format
+DEFAULT_CLIENT_LIMITS = {
+    'requests_per_minute': 600,
+    'upstream_per_minute': 30,
+    'max_concurrent': 8
+}
+QUOTA_PATH = os.environ.get('WEATHER_QUOTA_PATH', os.path.join(app.instance_path, 'quota.db'))
+INFLIGHT_TIMEOUT = 60  # seconds
+USAGE_COUNTERS = ('requests', 'upstream_calls', 'cache_hits', 'rejected')
+UPSTREAM_QUOTA_CLIENT = '*upstream*'  # Rate window shared by every client
+quota_local = threading.local()
+
+# Alert rules evaluated whenever a city's data is refreshed
+ALERTS_PATH = os.environ.get('WEATHER_ALERTS_PATH', os.path.join(app.instance_path, 'alerts.db'))
+ALERT_FIELDS = {
+    'weather': ('temperature', 'feels_like', 'temp_min', 'temp_max', 'humidity', 'pressure',
+                'wind_speed', 'clouds', 'weather_main', 'weather_description'),
+    'forecast': ('temp_min', 'temp_max', 'temp_avg', 'humidity', 'wind_speed',
+                 'weather_main', 'weather_description')
+}
+# Fields holding text take string values and these operators; all others are numeric
+ALERT_TEXT_FIELDS = ('weather_main', 'weather_description')
+ALERT_TEXT_OPERATORS = ('eq', 'ne', 'contains')
+# Rules and inputs are compared in metric, whatever units they arrive in
+ALERT_UNITS = 'metric'
+ALERT_TEMPERATURE_FIELDS = ('temperature', 'feels_like', 'temp_min', 'temp_max', 'temp_avg')
+MPS_PER_MPH = 0.44704
+ALERT_OPERATORS = {
+    'lt': operator.lt,
+    'lte': operator.le,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'contains': lambda actual, expected: str(expected) in str(actual)
+}
+ALERT_EVENT_MAX_AGE = 60 * 60  # seconds SSE events are kept for reconnecting clients
+ALERT_STREAM_MAX_AGE = 50  # seconds - kept below INFLIGHT_TIMEOUT so a stream keeps its slot
+ALERT_STREAM_POLL_INTERVAL = 2  # seconds
+# Optional comma-separated hosts webhook alerts may be sent to
+ALERT_WEBHOOK_HOSTS = {host.strip().lower() for host in
+                       os.environ.get('WEATHER_ALERT_WEBHOOK_HOSTS', '').split(',') if host.strip()}
+alerts_local = threading.local()
+alert_webhook_pool = ThreadPoolExecutor(max_workers=4)
+
+# Response encodings by mimetype, JSON first so it stays the default
+RESPONSE_ENCODERS = {'application/json': None}
+if msgpack is not None:
+    RESPONSE_ENCODERS['application/msgpack'] = msgpack.packb
+    RESPONSE_ENCODERS['application/x-msgpack'] = msgpack.packb
+if cbor2 is not None:
+    RESPONSE_ENCODERS['application/cbor'] = cbor2.dumps
+
+# Fields dropped by the lean schema - icon_url comes from weather_icon via
+# get_weather_icon_url and date is the display form of date_full
+LEAN_DROPPED_FIELDS = ('icon_url', 'date')
+
 # Mock weather data for demo mode
 DEMO_WEATHER_DATA = {
     'London': {
@@ -43,7 +143,7 @@ DEMO_WEATHER_DATA = {
         'weather_main': 'Clouds',
         'weather_description': 'Scattered Clouds',
         'weather_icon': '03d',
-        'icon_url': 'https://openweathermap.org/img/wn/03d@2x.png',
+        'icon_url': f'{ICON_BASE_URL}/03d.png',
         'sunrise': '06:23',
         'sunset': '19:45',
         'timezone': 0,
@@ -65,7 +165,7 @@ DEMO_WEATHER_DATA = {
         'weather_main': 'Clear',
         'weather_description': 'Clear Sky',
         'weather_icon': '01d',
-        'icon_url': 'https://openweathermap.org/img/wn/01d@2x.png',
+        'icon_url': f'{ICON_BASE_URL}/01d.png',
         'sunrise': '06:15',
         'sunset': '19:30',
         'timezone': -14400,
@@ -87,7 +187,7 @@ DEMO_WEATHER_DATA = {
         'weather_main': 'Rain',
         'weather_description': 'Light Rain',
         'weather_icon': '10d',
-        'icon_url': 'https://openweathermap.org/img/wn/10d@2x.png',
+        'icon_url': f'{ICON_BASE_URL}/10d.png',
         'sunrise': '05:30',
         'sunset': '18:15',
         'timezone': 32400,
@@ -109,7 +209,7 @@ DEMO_WEATHER_DATA = {
         'weather_main': 'Clear',
         'weather_description': 'Few Clouds',
         'weather_icon': '02d',
-        'icon_url': 'https://openweathermap.org/img/wn/02d@2x.png',
+        'icon_url': f'{ICON_BASE_URL}/02d.png',
         'sunrise': '06:45',
         'sunset': '20:00',
         'timezone': 3600,
@@ -131,7 +231,7 @@ DEMO_WEATHER_DATA = {
         'weather_main': 'Clear',
         'weather_description': 'Sunny',
         'weather_icon': '01d',
-        'icon_url': 'https://openweathermap.org/img/wn/01d@2x.png',
+        'icon_url': f'{ICON_BASE_URL}/01d.png',
         'sunrise': '06:00',
         'sunset': '19:45',
         'timezone': 36000,
@@ -141,11 +241,11 @@ DEMO_WEATHER_DATA = {
 
 DEMO_FORECAST_DATA = {
     'London': [
-        {'date': 'Mon, Feb 03', 'date_full': '2026-02-03', 'temp_min': 10, 'temp_max': 16, 'temp_avg': 13, 'humidity': 70, 'wind_speed': 3.2, 'weather_icon': '03d', 'icon_url': 'https://openweathermap.org/img/wn/03d@2x.png', 'weather_description': 'Scattered Clouds', 'weather_main': 'Clouds'},
-        {'date': 'Tue, Feb 04', 'date_full': '2026-02-04', 'temp_min': 9, 'temp_max': 14, 'temp_avg': 11, 'humidity': 75, 'wind_speed': 4.0, 'weather_icon': '04d', 'icon_url': 'https://openweathermap.org/img/wn/04d@2x.png', 'weather_description': 'Broken Clouds', 'weather_main': 'Clouds'},
-        {'date': 'Wed, Feb 05', 'date_full': '2026-02-05', 'temp_min': 11, 'temp_max': 17, 'temp_avg': 14, 'humidity': 65, 'wind_speed': 2.8, 'weather_icon': '02d', 'icon_url': 'https://openweathermap.org/img/wn/02d@2x.png', 'weather_description': 'Few Clouds', 'weather_main': 'Clear'},
-        {'date': 'Thu, Feb 06', 'date_full': '2026-02-06', 'temp_min': 8, 'temp_max': 13, 'temp_avg': 10, 'humidity': 80, 'wind_speed': 5.5, 'weather_icon': '10d', 'icon_url': 'https://openweathermap.org/img/wn/10d@2x.png', 'weather_description': 'Light Rain', 'weather_main': 'Rain'},
-        {'date': 'Fri, Feb 07', 'date_full': '2026-02-07', 'temp_min': 7, 'temp_max': 12, 'temp_avg': 9, 'humidity': 85, 'wind_speed': 6.0, 'weather_icon': '09d', 'icon_url': 'https://openweathermap.org/img/wn/09d@2x.png', 'weather_description': 'Showers', 'weather_main': 'Rain'}
+        {'date': 'Mon, Feb 03', 'date_full': '2026-02-03', 'temp_min': 10, 'temp_max': 16, 'temp_avg': 13, 'humidity': 70, 'wind_speed': 3.2, 'weather_icon': '03d', 'icon_url': f'{ICON_BASE_URL}/03d.png', 'weather_description': 'Scattered Clouds', 'weather_main': 'Clouds'},
+        {'date': 'Tue, Feb 04', 'date_full': '2026-02-04', 'temp_min': 9, 'temp_max': 14, 'temp_avg': 11, 'humidity': 75, 'wind_speed': 4.0, 'weather_icon': '04d', 'icon_url': f'{ICON_BASE_URL}/04d.png', 'weather_description': 'Broken Clouds', 'weather_main': 'Clouds'},
+        {'date': 'Wed, Feb 05', 'date_full': '2026-02-05', 'temp_min': 11, 'temp_max': 17, 'temp_avg': 14, 'humidity': 65, 'wind_speed': 2.8, 'weather_icon': '02d', 'icon_url': f'{ICON_BASE_URL}/02d.png', 'weather_description': 'Few Clouds', 'weather_main': 'Clear'},
+        {'date': 'Thu, Feb 06', 'date_full': '2026-02-06', 'temp_min': 8, 'temp_max': 13, 'temp_avg': 10, 'humidity': 80, 'wind_speed': 5.5, 'weather_icon': '10d', 'icon_url': f'{ICON_BASE_URL}/10d.png', 'weather_description': 'Light Rain', 'weather_main': 'Rain'},
+        {'date': 'Fri, Feb 07', 'date_full': '2026-02-07', 'temp_min': 7, 'temp_max': 12, 'temp_avg': 9, 'humidity': 85, 'wind_speed': 6.0, 'weather_icon': '09d', 'icon_url': f'{ICON_BASE_URL}/09d.png', 'weather_description': 'Showers', 'weather_main': 'Rain'}
     ]
 }
 
@@ -159,91 +259,1300 @@ def generate_demo_forecast(city_name, base_temp):
     icons = ['01d', '02d', '03d', '04d', '09d', '10d']
     descriptions = ['Sunny', 'Few Clouds', 'Scattered Clouds', 'Broken Clouds', 'Light Rain', 'Showers']
     
-    today = datetime.now()
+    today = datetime.now()
+    
+    for i in range(5):
+        date = today.replace(day=today.day + i)
+        day_name = days[date.weekday()]
+        month_name = months[date.month - 1]
+        
+        temp_variation = random.randint(-3, 3)
+        temp_max = base_temp + temp_variation
+        temp_min = temp_max - random.randint(5, 10)
+        
+        icon_idx = random.randint(0, len(icons) - 1)
+        
+        forecasts.append({
+            'date': f"{day_name}, {month_name} {date.day:02d}",
+            'date_full': date.strftime('%Y-%m-%d'),
+            'temp_min': temp_min,
+            'temp_max': temp_max,
+            'temp_avg': (temp_max + temp_min) // 2,
+            'humidity': random.randint(50, 90),
+            'wind_speed': round(random.uniform(2, 8), 1),
+            'weather_icon': icons[icon_idx],
+            'icon_url': get_weather_icon_url(icons[icon_idx]),
+            'weather_description': descriptions[icon_idx],
+            'weather_main': descriptions[icon_idx].split()[0]
+        })
+    
+    return forecasts
+
+
+def get_weather_icon_url(icon_code):
+    """
+    Generate URL for a weather icon served by this app.
+    
+    Args:
+        icon_code (str): Weather icon code from API
+        
+    Returns:
+        str: URL of the locally cached weather icon image
+    """
+    return f"{ICON_BASE_URL}/{icon_code}.png"
+
+
+def get_cached_icon_path(icon_code):
+    """
+    Return the local path of a weather icon, downloading it from
+    OpenWeatherMap the first time it is requested.
+    
+    Args:
+        icon_code (str): One of ICON_CODES
+        
+    Returns:
+        str: Path to the PNG file in ICON_CACHE_DIR
+    """
+    path = os.path.join(ICON_CACHE_DIR, f'{icon_code}.png')
+    if os.path.exists(path):
+        return path
+    
+    with icon_download_lock:
+        if not os.path.exists(path):
+            response = requests.get(ICON_SOURCE_URL.format(code=icon_code), timeout=10)
+            response.raise_for_status()
+            
+            # Write to a temporary file first so readers never see a partial icon
+            os.makedirs(ICON_CACHE_DIR, exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(response.content)
+            os.replace(tmp_path, path)
+    return path
+
+
+def build_icon_sprite():
+    """
+    Pack every weather icon into a single stylesheet of data URIs.
+    
+    Returns:
+        str: CSS with a '.weather-icon-{code}' class per icon
+    """
+    rules = []
+    for icon_code in ICON_CODES:
+        with open(get_cached_icon_path(icon_code), 'rb') as f:
+            encoded = base64.b64encode(f.read()).decode('ascii')
+        rules.append(
+            f'.weather-icon-{icon_code}{{background-image:url("data:image/png;base64,{encoded}");'
+            'background-size:contain;background-repeat:no-repeat}'
+        )
+    return '\n'.join(rules) + '\n'
+
+
+def format_timestamp(timestamp, timezone_offset=0):
+    """
+    Convert Unix timestamp to readable time format.
+    
+    Args:
+        timestamp (int): Unix timestamp
+        timezone_offset (int): Timezone offset in seconds
+        
+    Returns:
+        str: Formatted time string (HH:MM)
+    """
+    utc_time = datetime.utcfromtimestamp(timestamp)
+    local_time = datetime.utcfromtimestamp(timestamp + timezone_offset)
+    return local_time.strftime('%H:%M')
+
+
+def format_date(timestamp, timezone_offset=0):
+    """
+    Convert Unix timestamp to readable date format.
+    
+    Args:
+        timestamp (int): Unix timestamp
+        timezone_offset (int): Timezone offset in seconds
+        
+    Returns:
+        str: Formatted date string (Day, Month Date)
+    """
+    local_time = datetime.utcfromtimestamp(timestamp + timezone_offset)
+    return local_time.strftime('%a, %b %d')
+
+
+def celsius_to_fahrenheit(celsius):
+    """
+    Convert Celsius to Fahrenheit.
+    
+    Args:
+        celsius (float): Temperature in Celsius
+        
+    Returns:
+        float: Temperature in Fahrenheit
+    """
+    return (celsius * 9/5) + 32
+
+
+def format_weather_data(data, units):
+    """
+    Convert a raw OpenWeatherMap current weather response into the
+    payload served by the weather endpoints.
+    
+    Args:
+        data (dict): Decoded JSON from the /weather API
+        units (str): Temperature units the data was requested in
+        
+    Returns:
+        dict: Formatted weather data
+    """
+    return {
+        'city': data['name'],
+        'country': data['sys']['country'],
+        'temperature': round(data['main']['temp']),
+        'feels_like': round(data['main']['feels_like']),
+        'temp_min': round(data['main']['temp_min']),
+        'temp_max': round(data['main']['temp_max']),
+        'humidity': data['main']['humidity'],
+        'pressure': data['main']['pressure'],
+        'wind_speed': data['wind']['speed'],
+        'wind_deg': data['wind'].get('deg', 0),
+        'visibility': data.get('visibility', 0) / 1000,  # Convert to km
+        'clouds': data['clouds']['all'],
+        'weather_main': data['weather'][0]['main'],
+        'weather_description': data['weather'][0]['description'].title(),
+        'weather_icon': data['weather'][0]['icon'],
+        'icon_url': get_weather_icon_url(data['weather'][0]['icon']),
+        'sunrise': format_timestamp(data['sys']['sunrise'], data['timezone']),
+        'sunset': format_timestamp(data['sys']['sunset'], data['timezone']),
+        'timezone': data['timezone'],
+        'dt': data['dt'],
+        'units': units
+    }
+
+
+def format_forecast_data(data, units):
+    """
+    Group a raw OpenWeatherMap 3-hourly forecast response into daily
+    summaries for the forecast endpoints.
+    
+    Args:
+        data (dict): Decoded JSON from the /forecast API
+        units (str): Temperature units the data was requested in
+        
+    Returns:
+        dict: City details and up to 5 daily forecasts
+    """
+    daily_forecasts = {}
+    
+    for item in data['list']:
+        # Get date from timestamp
+        date_obj = datetime.utcfromtimestamp(item['dt'] + data['city']['timezone'])
+        date_key = date_obj.strftime('%Y-%m-%d')
+        
+        if date_key not in daily_forecasts:
+            daily_forecasts[date_key] = {
+                'date': date_obj.strftime('%a, %b %d'),
+                'date_full': date_obj.strftime('%Y-%m-%d'),
+                'temps': [],
+                'weather_icons': [],
+                'weather_descriptions': [],
+                'humidity': [],
+                'wind_speed': [],
+                'timestamps': []
+            }
+        
+        daily_forecasts[date_key]['temps'].append(item['main']['temp'])
+        daily_forecasts[date_key]['weather_icons'].append(item['weather'][0]['icon'])
+        daily_forecasts[date_key]['weather_descriptions'].append(item['weather'][0]['description'])
+        daily_forecasts[date_key]['humidity'].append(item['main']['humidity'])
+        daily_forecasts[date_key]['wind_speed'].append(item['wind']['speed'])
+        daily_forecasts[date_key]['timestamps'].append(item['dt'])
+    
+    # Calculate daily summaries
+    forecast_list = []
+    for date_key, day_data in list(daily_forecasts.items())[:5]:  # Limit to 5 days
+        # Get most frequent weather icon and description
+        icon_counts = {}
+        desc_counts = {}
+        for icon in day_data['weather_icons']:
+            icon_counts[icon] = icon_counts.get(icon, 0) + 1
+        for desc in day_data['weather_descriptions']:
+            desc_counts[desc] = desc_counts.get(desc, 0) + 1
+        
+        most_common_icon = max(icon_counts, key=icon_counts.get)
+        most_common_desc = max(desc_counts, key=desc_counts.get)
+        
+        forecast_list.append({
+            'date': day_data['date'],
+            'date_full': day_data['date_full'],
+            'temp_min': round(min(day_data['temps'])),
+            'temp_max': round(max(day_data['temps'])),
+            'temp_avg': round(sum(day_data['temps']) / len(day_data['temps'])),
+            'humidity': round(sum(day_data['humidity']) / len(day_data['humidity'])),
+            'wind_speed': round(max(day_data['wind_speed']), 1),
+            'weather_icon': most_common_icon,
+            'icon_url': get_weather_icon_url(most_common_icon),
+            'weather_description': most_common_desc.title(),
+            'weather_main': most_common_desc.split()[0].title()
+        })
+    
+    return {
+        'city': data['city']['name'],
+        'country': data['city']['country'],
+        'forecast': forecast_list,
+        'units': units
+    }
+
+
+def parse_fields(fields):
+    """
+    Parse a comma-separated field selection into a nested projection.
+    
+    Dotted names select fields of nested objects, e.g.
+    'city,forecast.temp_max' keeps 'city' and only 'temp_max' of each
+    forecast day.
+    
+    Args:
+        fields (str): Value of the 'fields' query parameter
+        
+    Returns:
+        dict: Projection tree, where None means keep the whole value
+    """
+    projection = {}
+    for name in fields.split(','):
+        parts = [part.strip() for part in name.split('.') if part.strip()]
+        node = projection
+        for i, part in enumerate(parts):
+            if i == len(parts) - 1:
+                node[part] = None
+            elif node.get(part, {}) is None:
+                break  # Parent already selected in full
+            else:
+                node = node.setdefault(part, {})
+    return projection
+
+
+def project_fields(value, projection):
+    """
+    Keep only the selected fields of a payload.
+    
+    Args:
+        value: Payload dict, or list of dicts
+        projection (dict): Tree returned by parse_fields
+        
+    Returns:
+        The payload restricted to the selected fields
+    """
+    if projection is None:
+        return value
+    if isinstance(value, list):
+        return [project_fields(item, projection) for item in value]
+    if isinstance(value, dict):
+        return {key: project_fields(value[key], sub) for key, sub in projection.items() if key in value}
+    return value
+
+
+def strip_derivable_fields(value):
+    """
+    Remove fields clients can rebuild themselves (the lean schema).
+    
+    Args:
+        value: Payload dict, or list of dicts
+        
+    Returns:
+        The payload without LEAN_DROPPED_FIELDS at any level
+    """
+    if isinstance(value, list):
+        return [strip_derivable_fields(item) for item in value]
+    if isinstance(value, dict):
+        return {key: strip_derivable_fields(item) for key, item in value.items()
+                if key not in LEAN_DROPPED_FIELDS}
+    return value
+
+
+def make_api_response(payload):
+    """
+    Build a successful API response, honouring the request's field
+    selection, schema and Accept header.
+    
+    Query Parameters:
+        fields (str): Comma-separated fields to return, dotted for nested
+        schema (str): 'lean' to drop derivable fields, default: full
+        
+    Args:
+        payload (dict): Full response payload
+        
+    Returns:
+        Response: JSON, MessagePack or CBOR encoded payload, or a 400
+        error if fields is empty or names a field the payload lacks
+    """
+    if request.args.get('schema') == 'lean':
+        payload = strip_derivable_fields(payload)
+    
+    if 'fields' in request.args:
+        projection = parse_fields(request.args['fields'])
+        unknown = [name for name in projection if name not in payload]
+        if not projection or unknown:
+            problem = f'Unknown fields: {", ".join(unknown)}' if unknown else 'No fields selected'
+            return jsonify({
+                'error': 'Invalid fields',
+                'message': f'{problem}. Available fields: {", ".join(payload)}'
+            }), 400
+        payload = project_fields(payload, projection)
+    
+    mimetype = request.accept_mimetypes.best_match(list(RESPONSE_ENCODERS), 'application/json')
+    if mimetype == 'application/json':
+        response = jsonify(payload)
+    else:
+        response = app.response_class(RESPONSE_ENCODERS[mimetype](payload), mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
+
+
+def open_snapshot(path=None):
+    """
+    Open the local snapshot database, creating its tables if needed.
+    
+    Args:
+        path (str): Database file, defaults to SNAPSHOT_PATH
+        
+    Returns:
+        sqlite3.Connection: Open connection to the snapshot
+    """
+    conn = sqlite3.connect(path or SNAPSHOT_PATH, timeout=30)
+    # WAL lets the web app keep reading while a warm run is writing
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS snapshot ('
+        'kind TEXT, city_key TEXT, units TEXT, payload TEXT, fetched_at REAL, '
+        'PRIMARY KEY (kind, city_key, units))'
+    )
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS warm_checkpoint ('
+        'source TEXT, line INTEGER, status TEXT, '
+        'PRIMARY KEY (source, line))'
+    )
+    return conn
+
+
+def load_snapshot(kind, city, units):
+    """
+    Look up fresh pre-computed data for a city in the local snapshot.
+    
+    Args:
+        kind (str): 'weather' or 'forecast'
+        city (str): City name as searched by the user
+        units (str): Temperature units (metric/imperial)
+        
+    Returns:
+        dict: Stored payload, or None if missing or older than SNAPSHOT_MAX_AGE
+    """
+    if not os.path.exists(SNAPSHOT_PATH):
+        return None
+    
+    try:
+        conn = sqlite3.connect(SNAPSHOT_PATH)
+        try:
+            row = conn.execute(
+                'SELECT payload, fetched_at FROM snapshot '
+                'WHERE kind = ? AND city_key = ? AND units = ?',
+                (kind, city.strip().lower(), units)
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    
+    if row is None or time.time() - row[1] > SNAPSHOT_MAX_AGE:
+        return None
+    return json.loads(row[0])
+
+
+def store_snapshot(conn, query, results):
+    """
+    Save fetched data for a city under the name it was listed as.
+    
+    Only the listed name is used: resolved names are ambiguous across
+    countries, e.g. 'Paris,FR' and 'Paris,US' both resolve to 'Paris'.
+    
+    Args:
+        conn (sqlite3.Connection): Open snapshot connection
+        query (str): City name as listed in the input file
+        results (dict): Formatted payloads keyed by kind
+    """
+    fetched_at = time.time()
+    for kind, payload in results.items():
+        conn.execute(
+            'INSERT OR REPLACE INTO snapshot VALUES (?, ?, ?, ?, ?)',
+            (kind, query.strip().lower(), payload['units'], json.dumps(payload), fetched_at)
+        )
+
+
+def load_api_keys(path):
+    """
+    Load client API keys and their limits from a JSON file.
+    
+    The file maps each key to its settings, e.g.
+    {"s3cret": {"name": "team-a", "requests_per_minute": 600}}.
+    Missing limits fall back to DEFAULT_CLIENT_LIMITS. Without a "name",
+    the client is labelled with a short hash of its key so the secret
+    never reaches usage counters. A "*" entry, if present, applies to
+    requests that send no key.
+    
+    Args:
+        path (str): JSON file path, or None to disable API keys
+        
+    Returns:
+        dict: Client settings keyed by API key
+        
+    Raises:
+        ValueError: If a client's name or limits are invalid
+    """
+    if not path:
+        return {}
+    
+    with open(path, encoding='utf-8') as f:
+        raw = json.load(f)
+    
+    clients = {}
+    for key, settings in raw.items():
+        label = 'key-' + hashlib.sha256(key.encode('utf-8')).hexdigest()[:8]
+        if not isinstance(settings, dict):
+            raise ValueError(f'{path}: settings for client "{label}" must be an object')
+        client = {**DEFAULT_CLIENT_LIMITS, 'name': label, **settings}
+        
+        # Checked here so a typo fails at startup rather than on a request
+        if not isinstance(client['name'], str) or not client['name']:
+            raise ValueError(f'{path}: name for client "{label}" must be a non-empty string')
+        for limit in DEFAULT_CLIENT_LIMITS:
+            value = client[limit]
+            if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+                raise ValueError(
+                    f'{path}: {limit} for client "{client["name"]}" must be a positive integer, got {value!r}'
+                )
+        clients[key] = client
+    return clients
+
+
+# Loaded once at startup - an empty dict leaves the API open to everyone
+API_KEYS = load_api_keys(os.environ.get('WEATHER_API_KEYS_FILE'))
+
+
+def open_quota_db():
+    """
+    Return this thread's connection to the shared quota database.
+    
+    Returns:
+        sqlite3.Connection: Connection in autocommit mode
+    """
+    conn = getattr(quota_local, 'conn', None)
+    if conn is None:
+        os.makedirs(os.path.dirname(os.path.abspath(QUOTA_PATH)), exist_ok=True)
+        conn = sqlite3.connect(QUOTA_PATH, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS rate_window ('
+            'client TEXT, kind TEXT, window INTEGER, count INTEGER, '
+            'PRIMARY KEY (client, kind, window))'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS inflight ('
+            'id INTEGER PRIMARY KEY, client TEXT, started REAL)'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS usage ('
+            'client TEXT, counter TEXT, count INTEGER, '
+            'PRIMARY KEY (client, counter))'
+        )
+        quota_local.conn = conn
+    return conn
+
+
+def record_usage(client, counter):
+    """
+    Increment one of a client's usage counters.
+    
+    Args:
+        client (str): Client name
+        counter (str): 'requests', 'upstream_calls', 'cache_hits' or 'rejected'
+    """
+    open_quota_db().execute(
+        'INSERT INTO usage VALUES (?, ?, 1) '
+        'ON CONFLICT (client, counter) DO UPDATE SET count = count + 1',
+        (client, counter)
+    )
+
+
+def take_quota(client, kind, limit):
+    """
+    Count one call against a client's per-minute limit.
+    
+    Args:
+        client (str): Client name
+        kind (str): 'requests' or 'upstream'
+        limit (int): Calls allowed per minute
+        
+    Returns:
+        bool: True if the call is within the limit
+    """
+    conn = open_quota_db()
+    window = int(time.time() // 60)
+    
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('DELETE FROM rate_window WHERE window < ?', (window,))
+        row = conn.execute(
+            'SELECT count FROM rate_window WHERE client = ? AND kind = ? AND window = ?',
+            (client, kind, window)
+        ).fetchone()
+        allowed = row is None or row[0] < limit
+        if allowed:
+            conn.execute(
+                'INSERT INTO rate_window VALUES (?, ?, ?, 1) '
+                'ON CONFLICT (client, kind, window) DO UPDATE SET count = count + 1',
+                (client, kind, window)
+            )
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return allowed
+
+
+def rate_limit_response(message):
+    """
+    Build a 429 response telling the client when to retry.
+    
+    Args:
+        message (str): Explanation for the client
+        
+    Returns:
+        tuple: JSON response and status code
+    """
+    response = jsonify({
+        'error': 'Rate Limit Exceeded',
+        'message': message
+    })
+    response.headers['Retry-After'] = str(60 - int(time.time()) % 60)
+    return response, 429
+
+
+def check_upstream_quota():
+    """
+    Count a call to OpenWeatherMap against the current client's budget.
+    
+    Snapshot hits never reach this, so they are free for every client.
+    The total across all clients is also capped at UPSTREAM_CALLS_PER_MINUTE
+    so no combination of clients can exhaust the OpenWeatherMap plan.
+    
+    Returns:
+        tuple: 429 response if the budget is spent, otherwise None
+    """
+    client = g.get('api_client')
+    if client is None:
+        return None
+    
+    if not take_quota(client['name'], 'upstream', client['upstream_per_minute']):
+        record_usage(client['name'], 'rejected')
+        return rate_limit_response('Upstream weather request limit reached for this API key')
+    
+    if not take_quota(UPSTREAM_QUOTA_CLIENT, 'upstream', UPSTREAM_CALLS_PER_MINUTE):
+        record_usage(client['name'], 'rejected')
+        return rate_limit_response('Upstream weather request limit reached for this service')
+    
+    record_usage(client['name'], 'upstream_calls')
+    return None
+
+
+def get_usage(client=None):
+    """
+    Read usage counters from the quota database.
+    
+    Args:
+        client (str): Only return this client's counters
+        
+    Returns:
+        dict: Counters keyed by client name
+    """
+    query = 'SELECT client, counter, count FROM usage'
+    params = ()
+    if client is not None:
+        query += ' WHERE client = ?'
+        params = (client,)
+    
+    usage = {}
+    for name, counter, count in open_quota_db().execute(query, params):
+        usage.setdefault(name, dict.fromkeys(USAGE_COUNTERS, 0))[counter] = count
+    return usage
+
+
+@app.before_request
+def authorize_api_client():
+    """
+    Identify the API client and enforce its request rate and concurrency
+    limits. /api/usage is identified but not limited. Does nothing
+    unless API keys are configured.
+    """
+    if not API_KEYS or not request.path.startswith('/api/'):
+        return None
+    
+    key = request.headers.get('X-API-Key') or request.args.get('api_key') or '*'
+    client = API_KEYS.get(key)
+    if client is None:
+        return jsonify({
+            'error': 'Unauthorized',
+            'message': 'A valid API key is required'
+        }), 401
+    
+    # Clients must always be able to read their own counters, even when throttled
+    if request.path == '/api/usage':
+        g.api_client = client
+        return None
+    
+    name = client['name']
+    record_usage(name, 'requests')
+    if not take_quota(name, 'requests', client['requests_per_minute']):
+        record_usage(name, 'rejected')
+        return rate_limit_response('Request limit reached for this API key')
+    
+    conn = open_quota_db()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Entries left behind by a crashed worker expire after INFLIGHT_TIMEOUT
+        conn.execute('DELETE FROM inflight WHERE started < ?', (time.time() - INFLIGHT_TIMEOUT,))
+        active = conn.execute('SELECT COUNT(*) FROM inflight WHERE client = ?', (name,)).fetchone()[0]
+        inflight_id = None
+        if active < client['max_concurrent']:
+            inflight_id = conn.execute(
+                'INSERT INTO inflight (client, started) VALUES (?, ?)', (name, time.time())
+            ).lastrowid
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    
+    if inflight_id is None:
+        record_usage(name, 'rejected')
+        return rate_limit_response('Too many concurrent requests for this API key')
+    
+    g.api_client = client
+    g.inflight_id = inflight_id
+    return None
+
+
+@app.teardown_request
+def release_api_client(error=None):
+    """Release the concurrency slot taken by authorize_api_client."""
+    inflight_id = g.pop('inflight_id', None)
+    if inflight_id is not None:
+        release_inflight(inflight_id)
+
+
+def release_inflight(inflight_id):
+    """
+    Free a concurrency slot.
+    
+    Args:
+        inflight_id (int): Row ID from the inflight table
+    """
+    open_quota_db().execute('DELETE FROM inflight WHERE id = ?', (inflight_id,))
+
+
+def open_alerts_db():
+    """
+    Return this thread's connection to the alert rules database.
+    
+    Returns:
+        sqlite3.Connection: Connection in autocommit mode
+    """
+    conn = getattr(alerts_local, 'conn', None)
+    if conn is None:
+        os.makedirs(os.path.dirname(os.path.abspath(ALERTS_PATH)), exist_ok=True)
+        conn = sqlite3.connect(ALERTS_PATH, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS rules ('
+            'id INTEGER PRIMARY KEY, owner TEXT, city_key TEXT, units TEXT, input_key TEXT, '
+            'op TEXT, value TEXT, sink TEXT, target TEXT, active INTEGER DEFAULT 0, created REAL)'
+        )
+        # Rules are looked up by the inputs that changed for one city
+        conn.execute('DROP INDEX IF EXISTS rules_by_input')
+        conn.execute('CREATE INDEX IF NOT EXISTS rules_by_city_input ON rules (city_key, input_key)')
+        conn.execute('CREATE INDEX IF NOT EXISTS rules_by_owner ON rules (owner)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS alert_inputs ('
+            'city_key TEXT, units TEXT, input_key TEXT, value TEXT, '
+            'PRIMARY KEY (city_key, units, input_key))'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS alert_events ('
+            'id INTEGER PRIMARY KEY, owner TEXT, channel TEXT, data TEXT, created REAL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS alert_events_by_channel ON alert_events (owner, channel, id)')
+        alerts_local.conn = conn
+    return conn
+
+
+def get_alert_city(name, country):
+    """
+    Build the city identifier alert rules and inputs are keyed on.
+    
+    The country is part of it because OpenWeatherMap names are not
+    unique, e.g. Paris in France and Paris in Texas.
+    
+    Args:
+        name (str): City name as reported by OpenWeatherMap
+        country (str): Country code as reported by OpenWeatherMap
+        
+    Returns:
+        str: e.g. 'Paris,FR' (stored lower-cased)
+    """
+    return f'{name.strip()},{country.strip()}'
+
+
+def lookup_snapshot_city(query):
+    """
+    Find OpenWeatherMap's city and country for a query in the warm snapshot.
+    
+    Args:
+        query (str): City name as given by the user, e.g. 'Paris,FR'
+        
+    Returns:
+        str: City from get_alert_city, or None if the query was never warmed
+    """
+    if not os.path.exists(SNAPSHOT_PATH):
+        return None
+    
+    try:
+        conn = sqlite3.connect(SNAPSHOT_PATH)
+        try:
+            row = conn.execute(
+                'SELECT payload FROM snapshot WHERE city_key = ? LIMIT 1',
+                (query.strip().lower(),)
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    
+    if row is None:
+        return None
+    payload = json.loads(row[0])
+    return get_alert_city(payload['city'], payload['country'])
+
+
+def resolve_city_name(query, units):
+    """
+    Resolve a city query to the city and country OpenWeatherMap reports
+    for it, which is what alert rules are evaluated under.
+    
+    The snapshot is checked first; otherwise the current weather API is
+    asked. In demo mode the query is split on its comma.
+    
+    Args:
+        query (str): City name, optionally with country code
+        units (str): Temperature units (metric/imperial)
+        
+    Returns:
+        str: City from get_alert_city, e.g. 'Paris,FR'
+        
+    Raises:
+        LookupError: If OpenWeatherMap does not know the city
+    """
+    city = lookup_snapshot_city(query)
+    if city is not None:
+        return city
+    
+    if DEMO_MODE:
+        name, _, country = query.partition(',')
+        return get_alert_city(name, country)
+    
+    params = {
+        'q': query.strip(),
+        'appid': OPENWEATHER_API_KEY,
+        'units': units
+    }
+    response = requests.get(f'{BASE_URL}/weather', params=params, timeout=10)
+    if response.status_code == 404:
+        raise LookupError('city not found')
+    response.raise_for_status()
+    data = response.json()
+    return get_alert_city(data['name'], data['sys']['country'])
+
+
+def get_alert_input_key(field, day=None):
+    """
+    Build the key identifying one rule input within a city's data.
+    
+    Args:
+        field (str): Field name from the weather or forecast payload
+        day (int): Forecast day index (0 = today), None for current weather
+        
+    Returns:
+        str: e.g. 'temperature' or 'forecast.1.weather_main'
+    """
+    if day is None:
+        return field
+    return f'forecast.{day}.{field}'
+
+
+def convert_alert_value(field, value, from_units, to_units):
+    """
+    Convert a temperature or wind speed between metric and imperial.
+    
+    Args:
+        field (str): Field the value belongs to
+        value: Value to convert - anything but a number is returned as is
+        from_units (str): Units of value (metric/imperial)
+        to_units (str): Units wanted (metric/imperial)
+        
+    Returns:
+        The converted value
+    """
+    if from_units == to_units or isinstance(value, bool) or not isinstance(value, (int, float)):
+        return value
+    
+    if field in ALERT_TEMPERATURE_FIELDS:
+        if to_units == 'metric':
+            return (value - 32) * 5 / 9
+        return celsius_to_fahrenheit(value)
+    if field == 'wind_speed':
+        if to_units == 'metric':
+            return value * MPS_PER_MPH
+        return value / MPS_PER_MPH
+    return value
+
+
+def round_alert_value(value):
+    """
+    Round a converted number so repeated conversions compare equal.
+    
+    Args:
+        value: Number to round - anything else is returned as is
+        
+    Returns:
+        The value to 2 decimals, as an int when it is whole
+    """
+    if isinstance(value, bool) or not isinstance(value, float):
+        return value
+    value = round(value, 2)
+    return int(value) if value.is_integer() else value
+
+
+def flatten_alert_inputs(kind, payload):
+    """
+    Extract the values alert rules can watch from a formatted payload,
+    converted to ALERT_UNITS.
+    
+    Args:
+        kind (str): 'weather' or 'forecast'
+        payload (dict): Output of format_weather_data or format_forecast_data
+        
+    Returns:
+        dict: Values keyed by get_alert_input_key
+    """
+    def to_alert_units(field, value):
+        return round_alert_value(convert_alert_value(field, value, payload['units'], ALERT_UNITS))
+    
+    if kind == 'weather':
+        return {field: to_alert_units(field, payload[field])
+                for field in ALERT_FIELDS['weather'] if field in payload}
+    
+    inputs = {}
+    for day, day_data in enumerate(payload['forecast']):
+        for field in ALERT_FIELDS['forecast']:
+            if field in day_data:
+                inputs[get_alert_input_key(field, day)] = to_alert_units(field, day_data[field])
+    return inputs
+
+
+def rule_matches(op, actual, expected):
+    """
+    Check a rule's condition against an input value.
+    
+    Args:
+        op (str): One of ALERT_OPERATORS
+        actual: Current value of the watched field
+        expected: Threshold or value given in the rule
+        
+    Returns:
+        bool: True if the condition holds
+    """
+    if isinstance(actual, str):
+        actual = actual.lower()
+    if isinstance(expected, str):
+        expected = expected.lower()
+    try:
+        return bool(ALERT_OPERATORS[op](actual, expected))
+    except TypeError:
+        return False  # e.g. a numeric threshold on a text field
+
+
+def fire_alerts(fired):
+    """
+    Hand fired rules to their sinks. A failing sink is logged and does
+    not stop the others.
+    
+    Args:
+        fired (list): (rule dict, alert event dict) pairs
+    """
+    for rule, event in fired:
+        try:
+            ALERT_SINKS[rule['sink']](rule, event)
+        except Exception:
+            app.logger.exception('Alert sink %s failed for rule %s', rule['sink'], rule['id'])
+
+
+def apply_rules(conn, rows, city, values):
+    """
+    Re-check rules against new input values and update their state.
+    Rules fire only when their condition changes from false to true.
+    
+    Args:
+        conn (sqlite3.Connection): Alerts connection inside a transaction
+        rows (list): Rule rows from the rules table
+        city (str): City name for the alert events
+        values (dict): Input values in ALERT_UNITS keyed by input key
+        
+    Returns:
+        list: (rule dict, alert event dict) pairs to send to sinks
+    """
+    fired = []
+    for rule_id, owner, units, input_key, op, value, sink, target, active in rows:
+        expected = json.loads(value)
+        actual = values[input_key]
+        matched = rule_matches(op, actual, expected)
+        if matched == bool(active):
+            continue
+        
+        conn.execute('UPDATE rules SET active = ? WHERE id = ?', (int(matched), rule_id))
+        if matched:
+            # Report values in the units the rule was created with
+            field = input_key.rsplit('.', 1)[-1]
+            rule = {'id': rule_id, 'owner': owner, 'sink': sink, 'target': target}
+            fired.append((rule, {
+                'rule_id': rule_id,
+                'city': city,
+                'field': input_key,
+                'op': op,
+                'value': round_alert_value(convert_alert_value(field, expected, ALERT_UNITS, units)),
+                'actual': round_alert_value(convert_alert_value(field, actual, ALERT_UNITS, units)),
+                'units': units,
+                'fired_at': int(time.time())
+            }))
+    return fired
+
+
+def evaluate_alerts(kind, payload):
+    """
+    Evaluate alert rules after a city's data has been refreshed.
+    
+    Only inputs whose value differs from the previous refresh are
+    considered, and only rules watching those inputs are loaded, so the
+    cost follows what changed rather than how many rules exist. Errors
+    are logged so a broken rule never fails the weather request.
+    
+    Args:
+        kind (str): 'weather' or 'forecast'
+        payload (dict): Output of format_weather_data or format_forecast_data
+    """
+    try:
+        city = get_alert_city(payload['city'], payload['country'])
+        city_key = city.lower()
+        units = ALERT_UNITS
+        inputs = {key: json.dumps(value) for key, value in flatten_alert_inputs(kind, payload).items()}
+        
+        conn = open_alerts_db()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            previous = dict(conn.execute(
+                'SELECT input_key, value FROM alert_inputs WHERE city_key = ? AND units = ?',
+                (city_key, units)
+            ))
+            changed = [key for key, value in inputs.items() if previous.get(key) != value]
+            conn.executemany(
+                'INSERT OR REPLACE INTO alert_inputs VALUES (?, ?, ?, ?)',
+                [(city_key, units, key, inputs[key]) for key in changed]
+            )
+            
+            fired = []
+            if changed:
+                rows = conn.execute(
+                    'SELECT id, owner, units, input_key, op, value, sink, target, active FROM rules '
+                    f'WHERE city_key = ? AND input_key IN ({",".join("?" * len(changed))})',
+                    (city_key, *changed)
+                ).fetchall()
+                values = {key: json.loads(inputs[key]) for key in changed}
+                fired = apply_rules(conn, rows, city, values)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        
+        fire_alerts(fired)
+    except Exception:
+        app.logger.exception('Failed to evaluate alerts for %s', payload.get('city'))
+
+
+def log_alert_sink(rule, event):
+    """Write a fired alert to the application log."""
+    app.logger.info('Alert %s fired: %s', rule['id'], json.dumps(event))
+
+
+def resolve_webhook_target(url):
+    """
+    Check that a webhook URL is safe for the server to POST to and
+    resolve the address to deliver it to.
+    
+    Only http(s) URLs are accepted, limited to ALERT_WEBHOOK_HOSTS when
+    that is set, and hosts resolving to private, loopback, link-local or
+    other non-public addresses are refused.
     
-    for i in range(5):
-        date = today.replace(day=today.day + i)
-        day_name = days[date.weekday()]
-        month_name = months[date.month - 1]
-        
-        temp_variation = random.randint(-3, 3)
-        temp_max = base_temp + temp_variation
-        temp_min = temp_max - random.randint(5, 10)
+    Args:
+        url (str): Webhook target URL
         
-        icon_idx = random.randint(0, len(icons) - 1)
+    Returns:
+        str: A checked IP address of the host
         
-        forecasts.append({
-            'date': f"{day_name}, {month_name} {date.day:02d}",
-            'date_full': date.strftime('%Y-%m-%d'),
-            'temp_min': temp_min,
-            'temp_max': temp_max,
-            'temp_avg': (temp_max + temp_min) // 2,
-            'humidity': random.randint(50, 90),
-            'wind_speed': round(random.uniform(2, 8), 1),
-            'weather_icon': icons[icon_idx],
-            'icon_url': f"https://openweathermap.org/img/wn/{icons[icon_idx]}@2x.png",
-            'weather_description': descriptions[icon_idx],
-            'weather_main': descriptions[icon_idx].split()[0]
-        })
+    Raises:
+        ValueError: With the reason the URL is refused
+    """
+    try:
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+    except ValueError:
+        raise ValueError('Webhook target must be a valid URL')
     
-    return forecasts
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError('Webhook target must be an http or https URL')
+    
+    host = parts.hostname.lower()
+    if ALERT_WEBHOOK_HOSTS and host not in ALERT_WEBHOOK_HOSTS:
+        raise ValueError(f'Webhook host "{host}" is not allowed')
+    
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)]
+    except (socket.gaierror, UnicodeError):
+        raise ValueError(f'Could not resolve webhook host "{host}"')
+    
+    for address in addresses:
+        if not ipaddress.ip_address(address.split('%')[0]).is_global:
+            raise ValueError(f'Webhook host "{host}" is not a public address')
+    return addresses[0]
 
 
-def get_weather_icon_url(icon_code):
+def check_webhook_target(url):
     """
-    Generate URL for weather icon from OpenWeatherMap.
+    Validate a webhook URL when a rule is created.
     
     Args:
-        icon_code (str): Weather icon code from API
+        url (str): Webhook target URL
         
     Returns:
-        str: Complete URL to weather icon image
+        str: Reason the URL is refused, or None if it is allowed
     """
-    return f"https://openweathermap.org/img/wn/{icon_code}@2x.png"
+    try:
+        resolve_webhook_target(url)
+    except ValueError as e:
+        return str(e)
+    return None
 
 
-def format_timestamp(timestamp, timezone_offset=0):
+def post_webhook(url, address, event):
     """
-    Convert Unix timestamp to readable time format.
+    POST an alert to a webhook, connecting to an already checked address.
+    
+    The connection goes to `address` rather than resolving the host again,
+    so DNS cannot be switched to a private address between the check and
+    the request. The Host header and TLS certificate check still use the
+    URL's host name. Redirects are not followed.
     
     Args:
-        timestamp (int): Unix timestamp
-        timezone_offset (int): Timezone offset in seconds
+        url (str): Webhook target URL
+        address (str): IP address returned by resolve_webhook_target
+        event (dict): Alert event to send as JSON
         
     Returns:
-        str: Formatted time string (HH:MM)
+        int: HTTP status code of the response
     """
-    utc_time = datetime.utcfromtimestamp(timestamp)
-    local_time = datetime.utcfromtimestamp(timestamp + timezone_offset)
-    return local_time.strftime('%H:%M')
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += f'?{parts.query}'
+    
+    if parts.scheme == 'https':
+        pool = urllib3.HTTPSConnectionPool(
+            address, port=parts.port or 443, server_hostname=parts.hostname,
+            assert_hostname=parts.hostname, cert_reqs='CERT_REQUIRED', ca_certs=requests.certs.where()
+        )
+    else:
+        pool = urllib3.HTTPConnectionPool(address, port=parts.port or 80)
+    
+    host_header = parts.netloc.rsplit('@', 1)[-1]
+    try:
+        response = pool.urlopen(
+            'POST', path, body=json.dumps(event).encode('utf-8'),
+            headers={'Host': host_header, 'Content-Type': 'application/json'},
+            redirect=False, retries=False, timeout=5
+        )
+        return response.status
+    finally:
+        pool.close()
 
 
-def format_date(timestamp, timezone_offset=0):
+def webhook_alert_sink(rule, event):
     """
-    Convert Unix timestamp to readable date format.
+    POST a fired alert as JSON to the rule's target URL.
+    
+    Delivery runs on a background pool and is attempted once, so a slow
+    receiver never holds up a weather request. The target is checked
+    again before sending, and the request goes to the checked address.
+    """
+    def deliver():
+        try:
+            address = resolve_webhook_target(rule['target'])
+        except ValueError as e:
+            app.logger.warning('Webhook for alert %s skipped: %s', rule['id'], e)
+            return
+        try:
+            post_webhook(rule['target'], address, event)
+        except urllib3.exceptions.HTTPError as e:
+            app.logger.warning('Webhook for alert %s failed: %s', rule['id'], e)
+    
+    alert_webhook_pool.submit(deliver)
+
+
+def sse_alert_sink(rule, event):
+    """
+    Queue a fired alert for /api/alerts/stream subscribers of the rule's
+    channel. Events are kept in the alerts database so any worker process
+    can stream them.
+    """
+    conn = open_alerts_db()
+    conn.execute('DELETE FROM alert_events WHERE created < ?', (time.time() - ALERT_EVENT_MAX_AGE,))
+    conn.execute(
+        'INSERT INTO alert_events (owner, channel, data, created) VALUES (?, ?, ?, ?)',
+        (rule['owner'], rule['target'], json.dumps(event), time.time())
+    )
+
+
+# Alert sinks by name - add an entry here to support another delivery method
+ALERT_SINKS = {
+    'log': log_alert_sink,
+    'webhook': webhook_alert_sink,
+    'sse': sse_alert_sink
+}
+
+
+class RateLimiter:
+    """Thread-safe limiter that spaces upstream calls evenly within a per-minute budget."""
+    
+    def __init__(self, calls_per_minute):
+        self.interval = 60.0 / calls_per_minute
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+        self.cancelled = threading.Event()
+    
+    def wait(self):
+        """Block until the caller may make its next upstream request."""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if self.cancelled.wait(max(0, slot - now)):
+            raise CancelledError()
+    
+    def cancel(self):
+        """Wake every waiting caller with an error so workers can stop."""
+        self.cancelled.set()
+
+
+def read_city_list(file):
+    """
+    Stream city names from a CSV file one row at a time.
+    
+    A header row with a 'city' column (and optionally 'country') is
+    detected automatically; otherwise the first column is used.
     
     Args:
-        timestamp (int): Unix timestamp
-        timezone_offset (int): Timezone offset in seconds
+        file: Open text file
+        
+    Yields:
+        tuple: (line number, city query string)
+    """
+    reader = csv.reader(file)
+    city_col, country_col = 0, None
+    
+    for row in reader:
+        if reader.line_num == 1:
+            header = [cell.strip().lower() for cell in row]
+            if 'city' in header:
+                city_col = header.index('city')
+                country_col = header.index('country') if 'country' in header else None
+                continue
+        
+        if len(row) <= city_col or not row[city_col].strip():
+            continue
+        
+        query = row[city_col].strip()
+        if country_col is not None and len(row) > country_col and row[country_col].strip():
+            query = f'{query},{row[country_col].strip()}'
+        yield reader.line_num, query
+
+
+def hash_city_list(path):
+    """
+    Hash a city list file in chunks, identifying it for checkpoints.
+    
+    Args:
+        path (str): CSV file path
         
     Returns:
-        str: Formatted date string (Day, Month Date)
+        str: Hex SHA-256 digest of the file contents
     """
-    local_time = datetime.utcfromtimestamp(timestamp + timezone_offset)
-    return local_time.strftime('%a, %b %d')
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
-def celsius_to_fahrenheit(celsius):
+def fetch_city_snapshot(query, units, limiter):
     """
-    Convert Celsius to Fahrenheit.
+    Fetch and format current weather and forecast for one city.
     
     Args:
-        celsius (float): Temperature in Celsius
+        query (str): City name, optionally with country code
+        units (str): Temperature units (metric/imperial)
+        limiter (RateLimiter): Shared upstream budget
         
     Returns:
-        float: Temperature in Fahrenheit
+        dict: Formatted payloads keyed by 'weather' and 'forecast'
     """
-    return (celsius * 9/5) + 32
+    results = {}
+    for kind, formatter in (('weather', format_weather_data), ('forecast', format_forecast_data)):
+        limiter.wait()
+        # Share the service-wide upstream cap with API traffic, waiting for
+        # the next minute window when it is spent
+        while not take_quota(UPSTREAM_QUOTA_CLIENT, 'upstream', UPSTREAM_CALLS_PER_MINUTE):
+            if limiter.cancelled.wait(60 - time.time() % 60):
+                raise CancelledError()
+        params = {
+            'q': query,
+            'appid': OPENWEATHER_API_KEY,
+            'units': units
+        }
+        response = requests.get(f'{BASE_URL}/{kind}', params=params, timeout=10)
+        
+        if response.status_code == 404:
+            raise LookupError('city not found')
+        response.raise_for_status()
+        
+        results[kind] = formatter(response.json(), units)
+    return results
 
 
 @app.route('/')
@@ -257,6 +1566,62 @@ def index():
     return render_template('index.html')
 
 
+@app.route('/icons/<icon_code>.png')
+def weather_icon(icon_code):
+    """
+    Serve a weather icon from the local cache.
+    
+    Args:
+        icon_code (str): Weather icon code, e.g. '03d'
+        
+    Returns:
+        PNG image with long-lived immutable cache headers
+    """
+    if icon_code not in ICON_CODES:
+        return jsonify({
+            'error': 'Not Found',
+            'message': f'Unknown weather icon "{icon_code}"'
+        }), 404
+    
+    try:
+        path = get_cached_icon_path(icon_code)
+    except requests.exceptions.RequestException:
+        return jsonify({
+            'error': 'Network Error',
+            'message': 'Failed to fetch weather icon'
+        }), 503
+    
+    response = send_file(path, mimetype='image/png', max_age=ICON_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route('/icons/sprite.css')
+def weather_icon_sprite():
+    """
+    Serve all weather icons packed into a single stylesheet.
+    
+    Returns:
+        CSS with one '.weather-icon-{code}' class per icon
+    """
+    global icon_sprite
+    if icon_sprite is None:
+        try:
+            icon_sprite = build_icon_sprite()
+        except requests.exceptions.RequestException:
+            return jsonify({
+                'error': 'Network Error',
+                'message': 'Failed to fetch weather icons'
+            }), 503
+    
+    response = app.response_class(icon_sprite, mimetype='text/css')
+    response.cache_control.public = True
+    response.cache_control.max_age = ICON_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route('/api/weather', methods=['GET'])
 def get_weather():
     """
@@ -303,7 +1668,18 @@ def get_weather():
             data['temp_max'] = round(celsius_to_fahrenheit(data['temp_max']))
         
         data['units'] = units
-        return jsonify(data)
+        return make_api_response(data)
+    
+    # Serve from the warm snapshot when it holds fresh data for this city
+    cached = load_snapshot('weather', city, units)
+    if cached is not None:
+        if 'api_client' in g:
+            record_usage(g.api_client['name'], 'cache_hits')
+        return make_api_response(cached)
+    
+    quota_error = check_upstream_quota()
+    if quota_error is not None:
+        return quota_error
     
     try:
         # Build API request for current weather
@@ -329,32 +1705,10 @@ def get_weather():
         
         data = response.json()
         
-        # Extract and format weather data
-        weather_data = {
-            'city': data['name'],
-            'country': data['sys']['country'],
-            'temperature': round(data['main']['temp']),
-            'feels_like': round(data['main']['feels_like']),
-            'temp_min': round(data['main']['temp_min']),
-            'temp_max': round(data['main']['temp_max']),
-            'humidity': data['main']['humidity'],
-            'pressure': data['main']['pressure'],
-            'wind_speed': data['wind']['speed'],
-            'wind_deg': data['wind'].get('deg', 0),
-            'visibility': data.get('visibility', 0) / 1000,  # Convert to km
-            'clouds': data['clouds']['all'],
-            'weather_main': data['weather'][0]['main'],
-            'weather_description': data['weather'][0]['description'].title(),
-            'weather_icon': data['weather'][0]['icon'],
-            'icon_url': get_weather_icon_url(data['weather'][0]['icon']),
-            'sunrise': format_timestamp(data['sys']['sunrise'], data['timezone']),
-            'sunset': format_timestamp(data['sys']['sunset'], data['timezone']),
-            'timezone': data['timezone'],
-            'dt': data['dt'],
-            'units': units
-        }
+        weather_data = format_weather_data(data, units)
+        evaluate_alerts('weather', weather_data)
         
-        return jsonify(weather_data)
+        return make_api_response(weather_data)
         
     except requests.exceptions.Timeout:
         return jsonify({
@@ -418,13 +1772,24 @@ def get_forecast():
                 day['temp_max'] = round(celsius_to_fahrenheit(day['temp_max']))
                 day['temp_avg'] = round(celsius_to_fahrenheit(day['temp_avg']))
         
-        return jsonify({
+        return make_api_response({
             'city': city,
             'country': DEMO_WEATHER_DATA[city_key]['country'],
             'forecast': forecast,
             'units': units
         })
     
+    # Serve from the warm snapshot when it holds fresh data for this city
+    cached = load_snapshot('forecast', city, units)
+    if cached is not None:
+        if 'api_client' in g:
+            record_usage(g.api_client['name'], 'cache_hits')
+        return make_api_response(cached)
+    
+    quota_error = check_upstream_quota()
+    if quota_error is not None:
+        return quota_error
+    
     try:
         # Build API request for 5-day forecast
         params = {
@@ -449,67 +1814,9 @@ def get_forecast():
         
         data = response.json()
         
-        # Process forecast data - group by day
-        daily_forecasts = {}
-        
-        for item in data['list']:
-            # Get date from timestamp
-            date_obj = datetime.utcfromtimestamp(item['dt'] + data['city']['timezone'])
-            date_key = date_obj.strftime('%Y-%m-%d')
-            
-            if date_key not in daily_forecasts:
-                daily_forecasts[date_key] = {
-                    'date': date_obj.strftime('%a, %b %d'),
-                    'date_full': date_obj.strftime('%Y-%m-%d'),
-                    'temps': [],
-                    'weather_icons': [],
-                    'weather_descriptions': [],
-                    'humidity': [],
-                    'wind_speed': [],
-                    'timestamps': []
-                }
-            
-            daily_forecasts[date_key]['temps'].append(item['main']['temp'])
-            daily_forecasts[date_key]['weather_icons'].append(item['weather'][0]['icon'])
-            daily_forecasts[date_key]['weather_descriptions'].append(item['weather'][0]['description'])
-            daily_forecasts[date_key]['humidity'].append(item['main']['humidity'])
-            daily_forecasts[date_key]['wind_speed'].append(item['wind']['speed'])
-            daily_forecasts[date_key]['timestamps'].append(item['dt'])
-        
-        # Calculate daily summaries
-        forecast_list = []
-        for date_key, day_data in list(daily_forecasts.items())[:5]:  # Limit to 5 days
-            # Get most frequent weather icon and description
-            icon_counts = {}
-            desc_counts = {}
-            for icon in day_data['weather_icons']:
-                icon_counts[icon] = icon_counts.get(icon, 0) + 1
-            for desc in day_data['weather_descriptions']:
-                desc_counts[desc] = desc_counts.get(desc, 0) + 1
-            
-            most_common_icon = max(icon_counts, key=icon_counts.get)
-            most_common_desc = max(desc_counts, key=desc_counts.get)
-            
-            forecast_list.append({
-                'date': day_data['date'],
-                'date_full': day_data['date_full'],
-                'temp_min': round(min(day_data['temps'])),
-                'temp_max': round(max(day_data['temps'])),
-                'temp_avg': round(sum(day_data['temps']) / len(day_data['temps'])),
-                'humidity': round(sum(day_data['humidity']) / len(day_data['humidity'])),
-                'wind_speed': round(max(day_data['wind_speed']), 1),
-                'weather_icon': most_common_icon,
-                'icon_url': get_weather_icon_url(most_common_icon),
-                'weather_description': most_common_desc.title(),
-                'weather_main': most_common_desc.split()[0].title()
-            })
-        
-        return jsonify({
-            'city': data['city']['name'],
-            'country': data['city']['country'],
-            'forecast': forecast_list,
-            'units': units
-        })
+        forecast_data = format_forecast_data(data, units)
+        evaluate_alerts('forecast', forecast_data)
+        return make_api_response(forecast_data)
         
     except requests.exceptions.Timeout:
         return jsonify({
@@ -565,7 +1872,11 @@ def get_weather_by_coords():
             data['temp_max'] = round(celsius_to_fahrenheit(data['temp_max']))
         
         data['units'] = units
-        return jsonify(data)
+        return make_api_response(data)
+    
+    quota_error = check_upstream_quota()
+    if quota_error is not None:
+        return quota_error
     
     try:
         # Build API request for current weather by coordinates
@@ -586,33 +1897,11 @@ def get_weather_by_coords():
         
         data = response.json()
         
-        # Extract and format weather data
-        weather_data = {
-            'city': data['name'],
-            'country': data['sys']['country'],
-            'temperature': round(data['main']['temp']),
-            'feels_like': round(data['main']['feels_like']),
-            'temp_min': round(data['main']['temp_min']),
-            'temp_max': round(data['main']['temp_max']),
-            'humidity': data['main']['humidity'],
-            'pressure': data['main']['pressure'],
-            'wind_speed': data['wind']['speed'],
-            'wind_deg': data['wind'].get('deg', 0),
-            'visibility': data.get('visibility', 0) / 1000,
-            'clouds': data['clouds']['all'],
-            'weather_main': data['weather'][0]['main'],
-            'weather_description': data['weather'][0]['description'].title(),
-            'weather_icon': data['weather'][0]['icon'],
-            'icon_url': get_weather_icon_url(data['weather'][0]['icon']),
-            'sunrise': format_timestamp(data['sys']['sunrise'], data['timezone']),
-            'sunset': format_timestamp(data['sys']['sunset'], data['timezone']),
-            'timezone': data['timezone'],
-            'dt': data['dt'],
-            'units': units,
-            'coords': {'lat': lat, 'lon': lon}
-        }
+        weather_data = format_weather_data(data, units)
+        weather_data['coords'] = {'lat': lat, 'lon': lon}
+        evaluate_alerts('weather', weather_data)
         
-        return jsonify(weather_data)
+        return make_api_response(weather_data)
         
     except Exception as e:
         return jsonify({
@@ -655,13 +1944,17 @@ def get_forecast_by_coords():
                 day['temp_max'] = round(celsius_to_fahrenheit(day['temp_max']))
                 day['temp_avg'] = round(celsius_to_fahrenheit(day['temp_avg']))
         
-        return jsonify({
+        return make_api_response({
             'city': 'London',
             'country': 'GB',
             'forecast': forecast,
             'units': units
         })
     
+    quota_error = check_upstream_quota()
+    if quota_error is not None:
+        return quota_error
+    
     try:
         params = {
             'lat': lat,
@@ -680,64 +1973,9 @@ def get_forecast_by_coords():
         
         data = response.json()
         
-        # Process forecast data (same logic as get_forecast)
-        daily_forecasts = {}
-        
-        for item in data['list']:
-            date_obj = datetime.utcfromtimestamp(item['dt'] + data['city']['timezone'])
-            date_key = date_obj.strftime('%Y-%m-%d')
-            
-            if date_key not in daily_forecasts:
-                daily_forecasts[date_key] = {
-                    'date': date_obj.strftime('%a, %b %d'),
-                    'date_full': date_obj.strftime('%Y-%m-%d'),
-                    'temps': [],
-                    'weather_icons': [],
-                    'weather_descriptions': [],
-                    'humidity': [],
-                    'wind_speed': [],
-                    'timestamps': []
-                }
-            
-            daily_forecasts[date_key]['temps'].append(item['main']['temp'])
-            daily_forecasts[date_key]['weather_icons'].append(item['weather'][0]['icon'])
-            daily_forecasts[date_key]['weather_descriptions'].append(item['weather'][0]['description'])
-            daily_forecasts[date_key]['humidity'].append(item['main']['humidity'])
-            daily_forecasts[date_key]['wind_speed'].append(item['wind']['speed'])
-            daily_forecasts[date_key]['timestamps'].append(item['dt'])
-        
-        forecast_list = []
-        for date_key, day_data in list(daily_forecasts.items())[:5]:
-            icon_counts = {}
-            desc_counts = {}
-            for icon in day_data['weather_icons']:
-                icon_counts[icon] = icon_counts.get(icon, 0) + 1
-            for desc in day_data['weather_descriptions']:
-                desc_counts[desc] = desc_counts.get(desc, 0) + 1
-            
-            most_common_icon = max(icon_counts, key=icon_counts.get)
-            most_common_desc = max(desc_counts, key=desc_counts.get)
-            
-            forecast_list.append({
-                'date': day_data['date'],
-                'date_full': day_data['date_full'],
-                'temp_min': round(min(day_data['temps'])),
-                'temp_max': round(max(day_data['temps'])),
-                'temp_avg': round(sum(day_data['temps']) / len(day_data['temps'])),
-                'humidity': round(sum(day_data['humidity']) / len(day_data['humidity'])),
-                'wind_speed': round(max(day_data['wind_speed']), 1),
-                'weather_icon': most_common_icon,
-                'icon_url': get_weather_icon_url(most_common_icon),
-                'weather_description': most_common_desc.title(),
-                'weather_main': most_common_desc.split()[0].title()
-            })
-        
-        return jsonify({
-            'city': data['city']['name'],
-            'country': data['city']['country'],
-            'forecast': forecast_list,
-            'units': units
-        })
+        forecast_data = format_forecast_data(data, units)
+        evaluate_alerts('forecast', forecast_data)
+        return make_api_response(forecast_data)
         
     except Exception as e:
         return jsonify({
@@ -746,6 +1984,288 @@ def get_forecast_by_coords():
         }), 500
 
 
+@app.route('/api/alerts', methods=['POST'])
+def create_alert():
+    """
+    API endpoint to register an alert rule for a city.
+    
+    JSON Body:
+        city (str): Name of the city
+        field (str): Field to watch, see ALERT_FIELDS
+        op (str): Comparison, one of ALERT_OPERATORS
+        value: Threshold or value to compare against
+        day (int): Forecast day (0 = today), omit to watch current weather
+        units (str): Units value is given in (metric/imperial), default: metric
+        sink (str): Where firings go, one of ALERT_SINKS, default: log
+        target (str): Webhook URL, or SSE channel name
+        
+    Returns:
+        JSON: The created rule
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        body = {}
+    city = body.get('city', '')
+    field = body.get('field')
+    op = body.get('op')
+    day = body.get('day')
+    units = body.get('units', 'metric')
+    sink = body.get('sink', 'log')
+    target = body.get('target')
+    
+    kind = 'weather' if day is None else 'forecast'
+    if not isinstance(city, str) or not city.strip():
+        message = 'Please provide a valid city name'
+    elif day is not None and (isinstance(day, bool) or not isinstance(day, int) or not 0 <= day <= 4):
+        message = 'day must be between 0 and 4'
+    elif not isinstance(field, str) or field not in ALERT_FIELDS[kind]:
+        message = f'field must be one of: {", ".join(ALERT_FIELDS[kind])}'
+    elif not isinstance(op, str) or op not in ALERT_OPERATORS:
+        message = f'op must be one of: {", ".join(ALERT_OPERATORS)}'
+    elif 'value' not in body:
+        message = 'Please provide a value to compare against'
+    elif field in ALERT_TEXT_FIELDS and op not in ALERT_TEXT_OPERATORS:
+        message = f'op for {field} must be one of: {", ".join(ALERT_TEXT_OPERATORS)}'
+    elif field in ALERT_TEXT_FIELDS and not isinstance(body['value'], str):
+        message = f'value for {field} must be a string'
+    elif field not in ALERT_TEXT_FIELDS and op == 'contains':
+        message = f'contains only applies to {", ".join(ALERT_TEXT_FIELDS)}'
+    elif field not in ALERT_TEXT_FIELDS and (isinstance(body['value'], bool)
+                                             or not isinstance(body['value'], (int, float))):
+        message = f'value for {field} must be a number'
+    elif units not in ('metric', 'imperial'):
+        message = 'units must be metric or imperial'
+    elif not isinstance(sink, str) or sink not in ALERT_SINKS:
+        message = f'sink must be one of: {", ".join(ALERT_SINKS)}'
+    elif target is not None and not isinstance(target, str):
+        message = 'target must be a string'
+    elif sink in ('webhook', 'sse') and not target:
+        message = f'A target is required for the {sink} sink'
+    else:
+        message = None
+    
+    if message is None and sink == 'webhook':
+        message = check_webhook_target(target)
+    
+    if message is not None:
+        return jsonify({
+            'error': 'Invalid alert rule',
+            'message': message
+        }), 400
+    
+    # Rules are matched against OpenWeatherMap's city and country, so
+    # resolve forms like 'Paris' or aliases before storing the rule
+    if DEMO_MODE or lookup_snapshot_city(city) is not None:
+        quota_error = None
+    else:
+        quota_error = check_upstream_quota()
+    if quota_error is not None:
+        return quota_error
+    
+    try:
+        city = resolve_city_name(city, units)
+    except LookupError:
+        return jsonify({
+            'error': 'City not found',
+            'message': f'Could not find weather data for "{city.strip()}". Please check the spelling.'
+        }), 400
+    except requests.exceptions.RequestException:
+        return jsonify({
+            'error': 'Network Error',
+            'message': 'Failed to connect to weather service'
+        }), 503
+    
+    owner = g.api_client['name'] if 'api_client' in g else ''
+    city_key = city.lower()
+    input_key = get_alert_input_key(field, day)
+    # Thresholds are stored in ALERT_UNITS so rules fire whatever units the data is fetched in
+    threshold = json.dumps(convert_alert_value(field, body['value'], units, ALERT_UNITS))
+    
+    conn = open_alerts_db()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rule_id = conn.execute(
+            'INSERT INTO rules (owner, city_key, units, input_key, op, value, sink, target, created) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (owner, city_key, units, input_key, op, threshold, sink, target, time.time())
+        ).lastrowid
+        
+        # Check the new rule against the latest data already seen for the city
+        fired = []
+        row = conn.execute(
+            'SELECT value FROM alert_inputs WHERE city_key = ? AND units = ? AND input_key = ?',
+            (city_key, ALERT_UNITS, input_key)
+        ).fetchone()
+        if row is not None:
+            rule_row = (rule_id, owner, units, input_key, op, threshold, sink, target, 0)
+            fired = apply_rules(conn, [rule_row], city, {input_key: json.loads(row[0])})
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    
+    fire_alerts(fired)
+    
+    return jsonify({
+        'id': rule_id,
+        'city': city,
+        'field': input_key,
+        'op': op,
+        'value': body['value'],
+        'units': units,
+        'sink': sink,
+        'target': target,
+        'active': bool(fired)
+    }), 201
+
+
+@app.route('/api/alerts', methods=['GET'])
+def list_alerts():
+    """
+    API endpoint to list the caller's alert rules.
+    
+    Query Parameters:
+        city (str): Only return rules for this city, e.g. 'Paris' or 'Paris,FR'
+        
+    Returns:
+        JSON: List of rules
+    """
+    owner = g.api_client['name'] if 'api_client' in g else ''
+    city = request.args.get('city', '').strip().lower()
+    
+    query = ('SELECT id, city_key, input_key, op, value, units, sink, target, active '
+             'FROM rules WHERE owner = ?')
+    params = [owner]
+    if ',' in city:
+        query += ' AND city_key = ?'
+        params.append(city)
+    elif city:
+        # A bare name matches that city in every country
+        query += " AND city_key LIKE ? ESCAPE '\\'"
+        escaped = city.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        params.append(f'{escaped},%')
+    
+    rules = [{
+        'id': rule_id,
+        'city': city_key,
+        'field': input_key,
+        'op': op,
+        'value': round_alert_value(
+            convert_alert_value(input_key.rsplit('.', 1)[-1], json.loads(value), ALERT_UNITS, units)
+        ),
+        'units': units,
+        'sink': sink,
+        'target': target,
+        'active': bool(active)
+    } for rule_id, city_key, input_key, op, value, units, sink, target, active
+        in open_alerts_db().execute(query + ' ORDER BY id', params)]
+    
+    return jsonify({'alerts': rules})
+
+
+@app.route('/api/alerts/<int:rule_id>', methods=['DELETE'])
+def delete_alert(rule_id):
+    """
+    API endpoint to remove one of the caller's alert rules.
+    
+    Args:
+        rule_id (int): Rule ID returned when it was created
+        
+    Returns:
+        Empty 204 response
+    """
+    owner = g.api_client['name'] if 'api_client' in g else ''
+    deleted = open_alerts_db().execute(
+        'DELETE FROM rules WHERE id = ? AND owner = ?', (rule_id, owner)
+    ).rowcount
+    
+    if not deleted:
+        return jsonify({
+            'error': 'Not Found',
+            'message': f'No alert rule with id {rule_id}'
+        }), 404
+    return '', 204
+
+
+@app.route('/api/alerts/stream', methods=['GET'])
+def stream_alerts():
+    """
+    API endpoint streaming alerts fired through the 'sse' sink as
+    Server-Sent Events.
+    
+    Each stream ends after ALERT_STREAM_MAX_AGE seconds; EventSource
+    clients reconnect with Last-Event-ID and miss nothing. Streams count
+    against the API key's concurrency cap while open.
+    
+    Query Parameters:
+        channel (str): Target channel used when the rules were created
+        
+    Returns:
+        text/event-stream of alert events
+    """
+    channel = request.args.get('channel', '').strip()
+    if not channel:
+        return jsonify({
+            'error': 'Channel is required',
+            'message': 'Please provide the channel used as the rule target'
+        }), 400
+    
+    owner = g.api_client['name'] if 'api_client' in g else ''
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = open_alerts_db().execute('SELECT COALESCE(MAX(id), 0) FROM alert_events').fetchone()[0]
+    
+    def generate(last_id):
+        # Tell the client where to resume from, even if no alert arrives
+        yield f'retry: 1000\nid: {last_id}\n\n'
+        
+        deadline = time.monotonic() + ALERT_STREAM_MAX_AGE
+        idle = 0
+        while time.monotonic() < deadline:
+            rows = open_alerts_db().execute(
+                'SELECT id, data FROM alert_events WHERE owner = ? AND channel = ? AND id > ? ORDER BY id',
+                (owner, channel, last_id)
+            ).fetchall()
+            for event_id, data in rows:
+                last_id = event_id
+                yield f'id: {event_id}\nevent: alert\ndata: {data}\n\n'
+            
+            idle = 0 if rows else idle + 1
+            if idle * ALERT_STREAM_POLL_INTERVAL >= 15:
+                idle = 0
+                yield ': keep-alive\n\n'
+            time.sleep(ALERT_STREAM_POLL_INTERVAL)
+    
+    response = app.response_class(generate(last_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    
+    # Hold the client's concurrency slot until the stream is closed
+    inflight_id = g.pop('inflight_id', None)
+    if inflight_id is not None:
+        response.call_on_close(lambda: release_inflight(inflight_id))
+    return response
+
+
+@app.route('/api/usage', methods=['GET'])
+def get_api_usage():
+    """
+    API endpoint reporting usage counters for the calling API key.
+    
+    Returns:
+        JSON: Request, upstream call, cache hit and rejection counts
+    """
+    if 'api_client' not in g:
+        return jsonify({
+            'error': 'Not Found',
+            'message': 'API keys are not enabled'
+        }), 404
+    
+    name = g.api_client['name']
+    usage = get_usage(name).get(name, dict.fromkeys(USAGE_COUNTERS, 0))
+    return jsonify({'client': name, **usage})
+
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
@@ -765,6 +2285,147 @@ def internal_error(error):
     }), 500
 
 
+# CLI commands
+weather_cli = AppGroup('weather', help='Weather data maintenance commands.')
+
+
+@weather_cli.command('warm')
+@click.option('--file', 'path', required=True, type=click.Path(exists=True, dir_okay=False),
+              help='CSV file listing one city per row.')
+@click.option('--units', type=click.Choice(['metric', 'imperial']), default='metric', show_default=True)
+@click.option('--workers', default=8, type=click.IntRange(min=1), show_default=True,
+              help='Number of concurrent fetch workers.')
+@click.option('--rate', default=UPSTREAM_CALLS_PER_MINUTE, type=click.IntRange(min=1), show_default=True,
+              help='Upstream API calls allowed per minute.')
+@click.option('--fresh', is_flag=True, help='Ignore the checkpoint from a previous run.')
+def warm_command(path, units, workers, rate, fresh):
+    """
+    Pre-fetch current weather and forecasts for every city in a CSV file.
+    
+    Results are written to the local snapshot served by the API endpoints.
+    Progress is checkpointed per row, so an interrupted run picks up where
+    it left off when started again with an unchanged file. The checkpoint
+    is cleared once a run completes, so the next run starts from the top.
+    """
+    if DEMO_MODE:
+        raise click.ClickException('Set OPENWEATHER_API_KEY to warm the snapshot.')
+    
+    os.makedirs(os.path.dirname(os.path.abspath(SNAPSHOT_PATH)), exist_ok=True)
+    conn = open_snapshot()
+    # Key the checkpoint on the file contents so a rewritten list starts over
+    source = f'{hash_city_list(path)}:{units}'
+    if fresh:
+        conn.execute('DELETE FROM warm_checkpoint WHERE source = ?', (source,))
+        conn.commit()
+    
+    limiter = RateLimiter(rate)
+    stats = {'done': 0, 'failed': 0, 'skipped': 0}
+    started = last_report = time.monotonic()
+    pending = {}
+    
+    def report():
+        elapsed = time.monotonic() - started
+        click.echo(
+            f"{stats['done']} warmed, {stats['failed']} failed, {stats['skipped']} skipped "
+            f"- {stats['done'] / elapsed if elapsed else 0:.1f} cities/s"
+        )
+    
+    def collect(return_when, timeout=None):
+        nonlocal last_report
+        finished, _ = wait(pending, timeout=timeout, return_when=return_when)
+        for future in finished:
+            line, query = pending.pop(future)
+            try:
+                results = future.result()
+                store_snapshot(conn, query, results)
+                for kind, payload in results.items():
+                    evaluate_alerts(kind, payload)
+                status = 'ok'
+                stats['done'] += 1
+            except CancelledError:
+                continue  # Stopped by Ctrl-C before it ran - no checkpoint
+            except Exception as e:
+                status = 'failed'
+                stats['failed'] += 1
+                click.echo(f'Line {line}: failed to warm "{query}": {e}', err=True)
+            conn.execute('INSERT OR REPLACE INTO warm_checkpoint VALUES (?, ?, ?)', (source, line, status))
+        conn.commit()
+        
+        if time.monotonic() - last_report >= 10:
+            report()
+            last_report = time.monotonic()
+    
+    try:
+        pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            with open(path, newline='', encoding='utf-8') as file:
+                for line, query in read_city_list(file):
+                    row = conn.execute(
+                        'SELECT status FROM warm_checkpoint WHERE source = ? AND line = ?',
+                        (source, line)
+                    ).fetchone()
+                    if row is not None and row[0] == 'ok':
+                        stats['skipped'] += 1
+                        continue
+                    
+                    pending[pool.submit(fetch_city_snapshot, query, units, limiter)] = (line, query)
+                    # Keep only a small window in flight so memory stays flat
+                    if len(pending) >= workers * 2:
+                        collect(FIRST_COMPLETED)
+            
+            if pending:
+                collect(ALL_COMPLETED)
+        except KeyboardInterrupt:
+            # Stop queued and rate-limited work, but keep what already finished
+            limiter.cancel()
+            pool.shutdown(wait=False, cancel_futures=True)
+            collect(ALL_COMPLETED, timeout=0)
+            report()
+            raise click.Abort()
+        finally:
+            pool.shutdown(wait=False)
+        
+        # Resuming only applies to an interrupted run
+        conn.execute('DELETE FROM warm_checkpoint WHERE source = ?', (source,))
+        conn.commit()
+    finally:
+        conn.close()
+    
+    report()
+
+
+
+@weather_cli.command('icons')
+def icons_command():
+    """
+    Download every weather icon into the local icon cache.
+    
+    Run at deploy time to bundle the icon set so no request ever waits
+    on OpenWeatherMap.
+    """
+    for icon_code in ICON_CODES:
+        try:
+            get_cached_icon_path(icon_code)
+        except requests.exceptions.RequestException as e:
+            raise click.ClickException(f'Failed to fetch icon {icon_code}: {e}')
+    click.echo(f'{len(ICON_CODES)} icons cached in {ICON_CACHE_DIR}')
+
+
+@weather_cli.command('usage')
+def usage_command():
+    """Print usage counters for every API key."""
+    usage = get_usage()
+    if not usage:
+        click.echo('No usage recorded.')
+        return
+    
+    click.echo('client\t' + '\t'.join(USAGE_COUNTERS))
+    for name, counters in sorted(usage.items()):
+        click.echo(name + '\t' + '\t'.join(str(counters[counter]) for counter in USAGE_COUNTERS))
+
+app.cli.add_command(weather_cli)
+
+
 if __name__ == '__main__':
     # Run the Flask application
     # Debug mode is enabled for development